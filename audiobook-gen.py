@@ -15,7 +15,13 @@
 #   pyenv global 3.12
 #
 #   pip install --upgrade pip
-#   python -m pip install torch==2.7.1 kokoro PyQt6
+#   python -m pip install torch==2.7.1 kokoro PyQt6 selectolax av
+#
+# CPU only, with --engine onnx:
+#   python -m pip install kokoro-onnx PyQt6 selectolax av
+#   wget https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/kokoro-v1.0.onnx
+#   wget https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/kokoro-v1.0.int8.onnx
+#   wget https://github.com/thewh1teagle/kokoro-onnx/releases/download/model-files-v1.0/voices-v1.0.bin
 #
 # Voices:
 # - https://huggingface.co/hexgrad/Kokoro-82M/blob/main/VOICES.md#american-english
@@ -26,16 +32,28 @@ import sys
 import argparse
 import subprocess
 import glob
-import wave
 import warnings
 import re
 import importlib
+import hashlib
+import shutil
+import queue
+import threading
+import time
+from typing import List, Tuple, Generator, Callable, Optional, Iterable
 import numpy as np
-from typing import List, Tuple, Generator, Callable, Optional
 
 import ebooklib
 from ebooklib import epub
-from bs4 import BeautifulSoup
+try:
+    import av
+except ImportError:
+    av = None
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+    from bs4 import BeautifulSoup
 from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                               QHBoxLayout, QGridLayout, QLabel, QPushButton,
                               QFileDialog, QComboBox, QSlider, QProgressBar,
@@ -48,13 +66,57 @@ from PyQt6.QtGui import QFont, QCloseEvent
 warnings.filterwarnings("ignore", message="dropout option adds dropout.")
 warnings.filterwarnings("ignore", message="`torch.nn.utils.weight_norm` is deprecated in favor of")
 
+# Let ops missing on Apple Silicon run on the CPU instead of failing
+os.environ.setdefault("PYTORCH_ENABLE_MPS_FALLBACK", "1")
+
+_modules = {}
+
+def lazy_import(name: str):
+    """Import a module on first use (torch and kokoro are slow to load)"""
+    if name not in _modules:
+        _modules[name] = importlib.import_module(name)
+    return _modules[name]
+
+
+# \w is str.isalnum() plus '_'
+_UNSAFE_FILENAME_RE = re.compile(r'[^\w-]')
 
 def clean_filename(parts: List[str]) -> str:
     """Convert a list of parts into a safe filename"""
     for i in range(len(parts)):
-        parts[i] = "".join(c if c.isalnum() or c in ('-', '_') else '_' for c in parts[i]).strip()
+        parts[i] = _UNSAFE_FILENAME_RE.sub('_', parts[i]).strip()
     return "_".join(parts)
 
+# Elements that start a new line, all text outside them is kept as well
+_BLOCK_TAGS = ("p, div, li, blockquote, h1, h2, h3, h4, h5, h6, br, hr, pre, table, tr, td, th, "
+               "ul, ol, dl, dt, dd, section, article, header, footer, aside, nav, figure, figcaption")
+_SKIP_TAGS = ["head", "script", "style"]
+
+def html_to_text(content: bytes) -> str:
+    """Extract the plain text of an HTML document, block elements on their own lines
+
+    >>> html_to_text(b"<div><h1>Chapter One</h1>It was a dark night.<br/>The end.</div>")
+    'Chapter One\\nIt was a dark night.\\nThe end.'
+    >>> html_to_text(b"<body>Loose text.<p>Para.</p><td>Cell</td></body>")
+    'Loose text.\\nPara.\\nCell'
+    """
+    if LexborHTMLParser is not None:
+        tree = LexborHTMLParser(content)
+        tree.strip_tags(_SKIP_TAGS, recursive=True)
+        blocks = tree.css(_BLOCK_TAGS)
+    else:
+        tree = BeautifulSoup(content, 'html.parser')
+        for node in tree.find_all(_SKIP_TAGS):
+            node.decompose()
+        blocks = tree.select(_BLOCK_TAGS)
+    # Newlines around each block, so its text doesn't run into its neighbours
+    for node in blocks:
+        node.insert_before("\n")
+        node.insert_after("\n")
+    text = tree.text() if LexborHTMLParser is not None else tree.get_text()
+    lines = (line.strip() for line in text.split("\n"))
+    return "\n".join(line for line in lines if line).replace('\u00A0', ' ')
+
 def list_items(filename: str):
     """List all items in an EPUB file (for debugging)"""
     book = epub.read_epub(filename)
@@ -216,11 +278,10 @@ class BookReader:
         if self.parts:
             return self.parts
 
-        for item in self.book.get_items_of_type(ebooklib.ITEM_DOCUMENT):
-            soup = BeautifulSoup(item.get_content(), 'html.parser')
-            text = soup.get_text().strip().replace('\u00A0', ' ')
-            if text:
-                self.parts.append(text)
+        # Parsing is C-backed, a process pool would cost more than it saves
+        # (fork from the Qt thread, or re-importing PyQt6 in every worker)
+        items = self.book.get_items_of_type(ebooklib.ITEM_DOCUMENT)
+        self.parts = [text for text in (html_to_text(item.get_content()) for item in items) if text]
 
         return self.parts
 
@@ -287,71 +348,496 @@ class BookReader:
                 f.write(parts[i])
 
 
-class TextToAudio:
-    _kokoro_module = None
+# Text cleanup for Kokoro in a single pass over the text:
+# - newlines and non-breaking spaces become spaces
+# - ". . ." becomes a single period
+# - single quotes are removed from contractions like he'd, she'll, can't, etc.
+# - sentences end with a newline
+_NORMALIZE_RE = re.compile(r"[\n\u00A0]|\.[ \n\u00A0]\.[ \n\u00A0]\.|\b(\w+)'(\w+)\b|[.!?]")
+
+def _normalize_match(m: re.Match) -> str:
+    """Replacement for a single _NORMALIZE_RE match"""
+    if m.group(1) is not None:
+        return m.group(1) + m.group(2)
+    c = m.group(0)
+    if c in ('\n', '\u00A0'):
+        return ' '
+    return c[0] + '\n'
+
+
+class OpusWriter:
+    """Encode raw 24kHz mono PCM to an OPUS file on a background thread"""
+
+    SAMPLE_RATE = 24000
+
+    def __init__(self, filename: str, on_complete: Optional[Callable] = None):
+        self.filename = filename
+        # Encode to a temporary name and replace the output on success. A new
+        # inode never truncates a cache entry the old output is hard linked to,
+        # and a failed encode leaves the old output alone.
+        root, ext = os.path.splitext(filename)
+        self.tmpFile = root + ".tmp" + ext
+        self.on_complete = on_complete
+        self.success = False
+        self.aborted = False
+        self.queue = queue.Queue(maxsize=64)
+        self.thread = threading.Thread(target=self._feed, daemon=True)
+        self.thread.start()
+
+    def _feed(self):
+        """Pass queued PCM chunks to the encoder until close() is called"""
+        chunks = self._chunks()
+        try:
+            if av is not None:
+                self.success = self._encode_av(chunks)
+            else:
+                self.success = self._encode_ffmpeg(chunks)
+        except Exception as e:
+            print(f"Failed to encode {self.filename}: {e}")
+        # Drop anything left so the producer never blocks on a full queue
+        for _ in chunks:
+            pass
+        if self.aborted:
+            self.success = False
+        if self.success:
+            try:
+                os.replace(self.tmpFile, self.filename)
+            except OSError as e:
+                print(f"Failed to write {self.filename}: {e}")
+                self.success = False
+        if not self.success:
+            # Don't leave truncated audio behind
+            try:
+                os.unlink(self.tmpFile)
+            except FileNotFoundError:
+                pass
+        if self.success and self.on_complete:
+            self.on_complete()
+
+    def _chunks(self):
+        """Yield queued chunks up to the end marker from close()"""
+        while (pcm := self.queue.get()) is not None:
+            yield pcm
+
+    def _encode_av(self, chunks) -> bool:
+        """Encode in-process with libopus through PyAV"""
+        with av.open(self.tmpFile, mode="w") as container:
+            stream = container.add_stream("libopus", rate=self.SAMPLE_RATE, layout="mono")
+            stream.bit_rate = 64000
+
+            def encode(pcm):
+                frame = av.AudioFrame.from_ndarray(pcm.reshape(1, -1), format="s16", layout="mono")
+                frame.sample_rate = self.SAMPLE_RATE
+                for packet in stream.encode(frame):
+                    container.mux(packet)
+
+            # 2 seconds of leading silence, same as adelay=2s with ffmpeg
+            encode(np.zeros(2 * self.SAMPLE_RATE, dtype=np.int16))
+            for pcm in chunks:
+                encode(pcm)
+            for packet in stream.encode(None):
+                container.mux(packet)
+        return True
+
+    def _encode_ffmpeg(self, chunks) -> bool:
+        """Encode by piping raw PCM into ffmpeg, no WAV file is written"""
+        cmd = ["ffmpeg", "-y", "-f", "s16le", "-ar", str(self.SAMPLE_RATE), "-ac", "1", "-i", "-",
+               "-af", "adelay=2s:all=true", "-c:a", "libopus", "-b:a", "64k", "-vbr", "on", self.tmpFile]
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            for pcm in chunks:
+                proc.stdin.write(pcm)
+        except BrokenPipeError:
+            # ffmpeg exited, its exit status reports the failure
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+        return proc.wait() == 0
+
+    def write(self, pcm):
+        """Queue a chunk of int16 samples for encoding"""
+        self.queue.put(pcm)
+
+    def close(self):
+        """Mark the end of the audio, encoding finishes in the background"""
+        self.queue.put(None)
+
+    def abort(self):
+        """End the audio early, the partial file is deleted"""
+        # Set before the end marker, the encoder thread sees it after draining
+        self.aborted = True
+        self.queue.put(None)
+
+    def wait(self) -> bool:
+        """Wait for the encoding to finish, returns True on success"""
+        self.thread.join()
+        return self.success
+
+
+class AudioCache:
+    """On-disk LRU cache of generated OPUS files keyed by text and voice settings"""
+
+    CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "audiobook-gen")
+
+    def __init__(self, max_gb: float):
+        self.max_bytes = int(max_gb * 1024 ** 3)
+        os.makedirs(self.CACHE_DIR, exist_ok=True)
+
+    def path(self, chunks: Iterable[str], *settings) -> str:
+        """Get the cache file for a text generated with the given settings"""
+        key = hashlib.sha256(("|".join(str(s) for s in settings) + "|").encode())
+        for chunk in chunks:
+            key.update(chunk.encode())
+        return os.path.join(self.CACHE_DIR, key.hexdigest() + ".opus")
+
+    def fetch(self, cacheFile: str, filename: str) -> bool:
+        """Copy a cached file to filename, returns False on a cache miss"""
+        try:
+            if not os.path.exists(filename):
+                shutil.copyfile(cacheFile, filename)
+            elif not os.path.samefile(cacheFile, filename):
+                # It may be hard linked to another entry, don't overwrite it in place
+                os.unlink(filename)
+                shutil.copyfile(cacheFile, filename)
+            # else store() already linked it on a previous run
+        except FileNotFoundError:
+            return False
+        # Touch the entry so it is evicted last
+        os.utime(cacheFile)
+        return True
+
+    def store(self, filename: str, cacheFile: str):
+        """Add a generated file to the cache and evict the oldest entries"""
+        try:
+            os.link(filename, cacheFile)
+        except FileExistsError:
+            pass
+        except OSError:
+            shutil.copyfile(filename, cacheFile)
+        self._prune()
+
+    def _prune(self):
+        """Delete least recently used entries until the cache fits max_bytes"""
+        with os.scandir(self.CACHE_DIR) as it:
+            entries = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in it if e.is_file())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
 
-    def __init__(self, voice="af_heart", speed=1.3):
+class TextToAudio:
+    _pipeline_cache = {}
+    _voice_cache = {}
+    _onnx_cache = {}
+    # One forward pass at a time on the device, no matter how many workers
+    # are generating. Concurrent passes only thrash the GPU caches.
+    _inference_lock = threading.Lock()
+    _cpu_threads_set = False
+
+    REPO_ID = 'hexgrad/Kokoro-82M'
+    PRECISIONS = {"fp32": "float32", "fp16": "float16", "bf16": "bfloat16"}
+    ENGINES = ["torch", "onnx"]
+    # kokoro-onnx release files, int8 is the quantized model
+    ONNX_MODELS = {"fp32": "kokoro-v1.0.onnx", "int8": "kokoro-v1.0.int8.onnx"}
+    ONNX_VOICES = "voices-v1.0.bin"
+    # Characters of text normalized at a time
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, voice="af_heart", speed=1.3, precision="fp16", batch_size=4, compile=False,
+                 cache_max_gb=2.0, engine="torch", onnx_model=None, onnx_voices=None):
         self.voice = voice
         self.speed = speed
+        self.batch_size = batch_size
+        self.compile = compile
+        self.cache = AudioCache(cache_max_gb) if cache_max_gb > 0 else None
+        self._writers = []
+        self._scratch = None
+        self.engine = engine
+        if engine == "onnx":
+            # Only the CPU is used, half precision would be slower there
+            self.onnx_model = onnx_model or self.ONNX_MODELS["int8" if precision == "int8" else "fp32"]
+            self.onnx_voices = onnx_voices or self.ONNX_VOICES
+            self.model_id = os.path.basename(self.onnx_model)
+            self.device = "cpu"
+            self.dtype = None
+        else:
+            if precision not in self.PRECISIONS:
+                raise ValueError(f"{precision} precision is only supported by the onnx engine")
+            self.model_id = self.REPO_ID
+            self.device = self._detect_device()
+            self.dtype = self._resolve_dtype(precision)
+
+    def _detect_device(self) -> str:
+        """Pick the fastest available device for inference"""
+        torch = lazy_import("torch")
+        if torch.cuda.is_available():
+            return "cuda"
+        if torch.backends.mps.is_available():
+            return "mps"
+        self._tune_cpu_threads()
+        return "cpu"
+
+    @staticmethod
+    def _tune_cpu_threads():
+        """Limit torch's CPU thread pools to avoid oversubscription"""
+        torch = lazy_import("torch")
+        if TextToAudio._cpu_threads_set:
+            return
+        TextToAudio._cpu_threads_set = True
+        # One thread per physical core, hyperthreads only add contention
+        torch.set_num_threads(max(1, (os.cpu_count() or 2) // 2))
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set before any inter-op parallel work has started
+            pass
+
+    def _resolve_dtype(self, precision: str):
+        """Map a precision name to the autocast dtype for the current device"""
+        torch = lazy_import("torch")
+        dtype = getattr(torch, self.PRECISIONS[precision])
+        # Half precision on the CPU is slower than full precision
+        if self.device == "cpu" and dtype == torch.float16:
+            dtype = torch.float32
+        return dtype
 
     def default_progress_callback(self, percent: float, message: str):
         """Default progress callback that prints to console"""
         print(f"[{percent:6.1f}%] {message}")
 
-    def _kokoro_generator(self, text: str) -> Generator:
-        """Generate audio from text using Kokoro (lazy loaded)"""
-        if TextToAudio._kokoro_module is None:
-            TextToAudio._kokoro_module = importlib.import_module("kokoro")
-        pipeline = TextToAudio._kokoro_module.KPipeline(lang_code='a', repo_id='hexgrad/Kokoro-82M')
-        yield from pipeline(text, voice=self.voice, speed=self.speed, split_pattern=r"\n+")
-
-    def _run_kokoro(self, txt, filename):
-        """Run Kokoro TTS on a text file and save to WAV"""
-        txt = txt.replace('\n', ' ')
-        txt = txt.replace('\u00A0', ' ')
-        txt = txt.replace('. . .', '.')
-        
-        # Remove single quotes from contractions like he'd, she'll, can't, etc.
-        txt = re.sub(r"\b(\w+)'(\w+)\b", r"\1\2", txt)
-
-        txt = txt.replace('.', '.\n')
-        txt = txt.replace('!', '!\n')
-        txt = txt.replace('?', '?\n')
-
-        with wave.open(filename, "wb") as wav_file:
-            wav_file.setnchannels(1)
-            wav_file.setsampwidth(2)
-            wav_file.setframerate(24000)
-
-            for result in self._kokoro_generator(txt):
-                if result.audio is None:
-                    continue
-                audio_bytes = (result.audio.numpy() * 32767).astype(np.int16).tobytes()
-                wav_file.writeframes(audio_bytes)
-
-    def run(self, text: str, filename: str, progress_callback=None):
-        """Generate audio from a text file"""
+    def _autocast(self):
+        """Autocast context for the selected precision"""
+        torch = lazy_import("torch")
+        # Autocast instead of casting the weights, the voice packs stay in float32
+        return torch.autocast(self.device, dtype=self.dtype, enabled=self.dtype != torch.float32)
+
+    def _get_pipeline(self, lang_code='a'):
+        """Get the Kokoro G2P pipeline and model, built once per process"""
+        key = (lang_code, self.device, self.dtype, self.compile)
+        cached = TextToAudio._pipeline_cache.get(key)
+        if cached is None:
+            kokoro = lazy_import("kokoro")
+            # The pipeline only does G2P and chunking, the model is run directly
+            # so its output stays on the device
+            pipeline = kokoro.KPipeline(lang_code=lang_code, repo_id=self.REPO_ID, model=False)
+            model = kokoro.KModel(repo_id=self.REPO_ID).to(self.device).eval()
+            cached = TextToAudio._pipeline_cache[key] = (pipeline, model)
+            if self.compile:
+                self._compile_model(model)
+        return cached
+
+    def _compile_model(self, model):
+        """Compile the Kokoro decoder, keeping eager mode if compiling fails"""
+        torch = lazy_import("torch")
+        decoder = model.decoder
+        # Only the decoder: KModel.forward takes a phoneme string, which would
+        # recompile for every sentence. Input lengths vary, hence dynamic shapes.
+        model.decoder = torch.compile(decoder, dynamic=True)
+        try:
+            # Compile now instead of in the middle of the first part
+            for _ in self._kokoro_generator(["Warm up."]):
+                pass
+        except Exception as e:
+            print(f"torch.compile failed, using eager mode: {e}")
+            model.decoder = decoder
+
+    def _get_voice_pack(self, pipeline):
+        """Get the voice pack on the device, loaded once per process"""
+        key = (id(pipeline), self.voice)
+        pack = TextToAudio._voice_cache.get(key)
+        if pack is None:
+            pack = TextToAudio._voice_cache[key] = pipeline.load_voice(self.voice).to(self.device)
+        return pack
+
+    def _infer(self, model, ps: str, pack):
+        """Run the model on one chunk of phonemes, returns audio on the device"""
+        torch = lazy_import("torch")
+        input_ids = [i for i in map(model.vocab.get, ps) if i is not None]
+        input_ids = torch.tensor([[0, *input_ids, 0]], dtype=torch.long, device=self.device)
+        audio, _ = model.forward_with_tokens(input_ids, pack[len(ps) - 1], self.speed)
+        return audio
+
+    def _kokoro_generator(self, lines: Iterable[str]) -> Generator:
+        """Generate audio from lines of text using Kokoro"""
+        pipeline, model = self._get_pipeline()
+        torch = lazy_import("torch")
+        pack = self._get_voice_pack(pipeline)
+        for result in pipeline(lines):
+            with TextToAudio._inference_lock, torch.inference_mode(), self._autocast():
+                audio = self._infer(model, result.phonemes, pack)
+            yield audio
+
+    def _get_onnx(self):
+        """Get the kokoro-onnx model, built once per process"""
+        key = (self.onnx_model, self.onnx_voices)
+        kokoro = TextToAudio._onnx_cache.get(key)
+        if kokoro is None:
+            ort = lazy_import("onnxruntime")
+            kokoro_onnx = lazy_import("kokoro_onnx")
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = os.cpu_count() or 1
+            session = ort.InferenceSession(self.onnx_model, sess_options=options,
+                                           providers=["CPUExecutionProvider"])
+            kokoro = TextToAudio._onnx_cache[key] = kokoro_onnx.Kokoro.from_session(session, self.onnx_voices)
+        return kokoro
+
+    def _onnx_generator(self, lines: Iterable[str]) -> Generator:
+        """Generate audio from lines of text using kokoro-onnx"""
+        kokoro = self._get_onnx()
+        for line in lines:
+            with TextToAudio._inference_lock:
+                audio, _ = kokoro.create(line, voice=self.voice, speed=self.speed, lang="en-us")
+            yield audio
+
+    def _normalize(self, chunks: Iterable[str]) -> Generator:
+        """Normalize text chunks, sentences end with a newline in the output"""
+        buf = ""
+        for chunk in chunks:
+            buf += chunk
+            if len(buf) < self.READ_SIZE:
+                continue
+            # No _NORMALIZE_RE match spans a newline unless a '.' follows it
+            cut = buf.rfind('\n', 0, len(buf) - 1)
+            while cut >= 0 and buf[cut + 1] == '.':
+                cut = buf.rfind('\n', 0, cut)
+            if cut >= 0:
+                yield _NORMALIZE_RE.sub(_normalize_match, buf[:cut + 1])
+                buf = buf[cut + 1:]
+        yield _NORMALIZE_RE.sub(_normalize_match, buf)
+
+    def _batch_sentences(self, txt: Iterable[str]) -> Generator:
+        """Join sentences into lines of batch_size sentences"""
+        # Kokoro runs one forward pass per line, a single sentence leaves the GPU
+        # mostly idle. Lines past the model context get split again by Kokoro.
+        batch = []
+        partial = ""
+        for piece in txt:
+            *sentences, partial = (partial + piece).split('\n')
+            for s in sentences:
+                if s.strip():
+                    batch.append(s.strip())
+                    if len(batch) == self.batch_size:
+                        yield ' '.join(batch)
+                        batch = []
+        if partial.strip():
+            batch.append(partial.strip())
+        if batch:
+            yield ' '.join(batch)
+
+    def _run_kokoro(self, chunks: Iterable[str], writer):
+        """Run Kokoro TTS on text chunks and send the audio to writer"""
+        txt = self._batch_sentences(self._normalize(chunks))
+
+        if self.engine == "onnx":
+            for audio in self._onnx_generator(txt):
+                # Clip before scaling, samples past 1.0 would wrap around in int16
+                np.clip(audio, -1.0, 1.0, out=audio)
+                writer.write((audio * 32767.0).astype(np.int16))
+            return
+
+        # Copies off the GPU are asynchronous, a chunk is handed to the writer
+        # after the work for the next chunk has been queued
+        pending = None
+        for audio in self._kokoro_generator(txt):
+            copy = self._copy_to_host(self._to_pcm(audio))
+            if pending:
+                writer.write(self._host_pcm(*pending))
+            pending = copy
+        if pending:
+            writer.write(self._host_pcm(*pending))
+
+    def _to_pcm(self, audio):
+        """Convert float audio to int16 samples on the device"""
+        torch = lazy_import("torch")
+        # Reuse one float buffer across chunks
+        n = audio.numel()
+        if self._scratch is None or self._scratch.numel() < n:
+            self._scratch = torch.empty(n, dtype=torch.float32, device=self.device)
+        buf = self._scratch[:n]
+        # Clip before scaling, samples past 1.0 would wrap around in int16
+        torch.clamp(audio.reshape(-1), -1.0, 1.0, out=buf)
+        return buf.mul_(32767.0).to(torch.int16)
+
+    def _copy_to_host(self, pcm):
+        """Start copying samples to host memory, returns (tensor, ready event)"""
+        torch = lazy_import("torch")
+        if self.device != "cuda":
+            return pcm.cpu(), None
+        host = torch.empty(pcm.shape, dtype=pcm.dtype, pin_memory=True)
+        host.copy_(pcm, non_blocking=True)
+        event = torch.cuda.Event()
+        event.record()
+        return host, event
+
+    def _host_pcm(self, host, event):
+        """Wait for a copy from _copy_to_host and return the samples"""
+        if event is not None:
+            event.synchronize()
+        return host.numpy()
+
+    @staticmethod
+    def _text_chunks(text) -> Iterable[str]:
+        """Iterate over a string, or over an open text file from the start"""
+        if isinstance(text, str):
+            return [text]
+        text.seek(0)
+        return text
+
+    def run(self, text, filename: str, progress_callback=None):
+        """Generate audio from a string or an open text file
+
+        A file is read as generation goes instead of all at once. Encoding
+        finishes in the background while the next part generates, call
+        wait() after the last part.
+        """
         if filename.endswith('.txt'):
             filename = filename[:-4]
 
         if progress_callback is None:
             progress_callback = self.default_progress_callback
 
-        waveFile = filename + ".wav"
         opusFile = filename + ".opus"
 
-        progress_callback(5.0, "Generating WAV...")
-        self._run_kokoro(text, waveFile)
+        cacheFile = None
+        if self.cache:
+            cacheFile = self.cache.path(self._text_chunks(text), self.model_id, self.voice, self.speed,
+                                        self.dtype, self.batch_size)
+            if self.cache.fetch(cacheFile, opusFile):
+                progress_callback(100.0, "Copied from cache")
+                return
+
+        def on_complete():
+            if cacheFile:
+                self.cache.store(opusFile, cacheFile)
+            progress_callback(100.0, "Generation complete")
 
-        progress_callback(75.0, "Converting to OPUS...")
-        cmd = ["ffmpeg", "-y", "-i", waveFile, "-af", "adelay=2s:all=true",
-               "-c:a", "libopus", "-b:a", "64k", "-vbr", "on", opusFile]
-        result = subprocess.run(cmd, capture_output=True, text=True)
+        progress_callback(5.0, "Generating OPUS...")
+        writer = OpusWriter(opusFile, on_complete)
+        self._writers.append(writer)
+        try:
+            self._run_kokoro(self._text_chunks(text), writer)
+        except BaseException:
+            # A partial part must not be reported complete or cached
+            writer.abort()
+            raise
+        writer.close()
 
-        if result.returncode == 0:
-            progress_callback(95.0, "Deleting WAV...")
-            subprocess.run(["rm", waveFile])
-            progress_callback(100.0, "Generation complete")
+    def wait(self) -> bool:
+        """Wait for all parts to finish encoding, returns True if all succeeded"""
+        success = all([writer.wait() for writer in self._writers])
+        self._writers = []
+        return success
 
 
 class AudioGenerationWorker(QThread):
@@ -360,18 +846,51 @@ class AudioGenerationWorker(QThread):
     finished = pyqtSignal(bool)  # success
     error = pyqtSignal(str)  # error message
 
-    def __init__(self, voice: str, speed: float, book: BookReader, start_idx: int, end_idx: int):
+    # Minimum seconds between progress signals, each one is a cross-thread dispatch
+    PROGRESS_INTERVAL = 0.25
+
+    def __init__(self, voice: str, speed: float, book: BookReader, start_idx: int, end_idx: int,
+                 precision: str = "fp16", batch_size: int = 4):
         super().__init__()
         self.voice = voice
         self.speed = speed
+        self.precision = precision
+        self.batch_size = batch_size
         self.book = book
         self.start_idx = start_idx
         self.end_idx = end_idx
+        self._last_emit = 0.0
+        self._pending = None
+        # Called from this thread and from the encoder threads on completion
+        self._progress_lock = threading.Lock()
+
+    def _emit_progress(self, message: str, progress: float, force: bool = False):
+        """Emit a progress signal, holding back updates that come too close together
+
+        The latest held back update is sent ahead of the next one that goes out.
+        """
+        with self._progress_lock:
+            now = time.monotonic()
+            if not force and now - self._last_emit < self.PROGRESS_INTERVAL:
+                self._pending = (message, progress)
+                return
+            if self._pending:
+                self.progress.emit(*self._pending)
+                self._pending = None
+            self._last_emit = now
+            self.progress.emit(message, progress)
+
+    def _flush_progress(self):
+        """Send the update still held back, if any"""
+        with self._progress_lock:
+            if self._pending:
+                self.progress.emit(*self._pending)
+                self._pending = None
 
     def run(self):
         """Run the audio generation process in background"""
         try:
-            tts = TextToAudio(self.voice, self.speed)
+            tts = TextToAudio(self.voice, self.speed, self.precision, self.batch_size)
             outdir, title = self.book.makedir()
             total_parts = self.end_idx - self.start_idx + 1
 
@@ -380,18 +899,26 @@ class AudioGenerationWorker(QThread):
                 basename = self.book.partBasename(outdir, title, i)
 
                 def make_part_progress_callback(part_num, total_parts):
+                    first = True
+
                     def part_progress_callback(percent: float, message: str):
+                        nonlocal first
                         overall_percent = ((part_num - 1) + percent / 100.0) / total_parts
                         status = f"Part {part_num}/{total_parts}: {message}"
-                        self.progress.emit(status, overall_percent)
+                        # Always show when a part starts
+                        self._emit_progress(status, overall_percent, force=first)
+                        first = False
                     return part_progress_callback
 
                 progress_callback = make_part_progress_callback(current_part, total_parts)
                 tts.run(self.book.parts[i], basename, progress_callback)
                 part_complete_progress = current_part / total_parts
-                self.progress.emit(f"Completed part {current_part}/{total_parts}", part_complete_progress)
+                self._emit_progress(f"Completed part {current_part}/{total_parts}",
+                                    part_complete_progress, force=True)
 
-            self.finished.emit(True)
+            success = tts.wait()
+            self._flush_progress()
+            self.finished.emit(success)
         except Exception as e:
             self.error.emit(str(e))
 
@@ -728,12 +1255,22 @@ def process_file_cli(filename: str, args):
         BookReader(filename).dump()
     elif mode == "dir":
         txtFiles = glob.glob(os.path.join(filename, "*.txt"))
-        tts = TextToAudio(voice=args.voice, speed=args.speed)
+        tts = TextToAudio(voice=args.voice, speed=args.speed, precision=args.precision,
+                          batch_size=args.batch_size, compile=args.compile,
+                          cache_max_gb=args.cache_max_gb, engine=args.engine,
+                          onnx_model=args.onnx_model, onnx_voices=args.onnx_voices)
         for f in txtFiles:
-            tts.run(open(f).read(), f)
+            with open(f, encoding='utf-8') as fh:
+                tts.run(fh, f)
+        return tts.wait()
     elif mode == "txt":
-        tts = TextToAudio(voice=args.voice, speed=args.speed)
-        tts.run(open(filename).read(), filename)
+        tts = TextToAudio(voice=args.voice, speed=args.speed, precision=args.precision,
+                          batch_size=args.batch_size, compile=args.compile,
+                          cache_max_gb=args.cache_max_gb, engine=args.engine,
+                          onnx_model=args.onnx_model, onnx_voices=args.onnx_voices)
+        with open(filename, encoding='utf-8') as fh:
+            tts.run(fh, filename)
+        return tts.wait()
     else:
         print(f"Unknown mode: {mode}")
         return False
@@ -770,10 +1307,29 @@ Examples:
                        help="Select the voice to use (default: af_heart)")
     parser.add_argument("-s", "--speed", type=float, default=1.3,
                        help="Set the speed of the voice (default: 1.3)")
+    parser.add_argument("-p", "--precision", default="fp16",
+                       choices=[*TextToAudio.PRECISIONS, "int8"],
+                       help="Set the inference precision on GPU, fp32 for unstable voices, "
+                            "int8 for the quantized onnx model (default: fp16)")
+    parser.add_argument("-b", "--batch-size", type=int, default=4,
+                       help="Set the number of sentences per inference call (default: 4)")
+    parser.add_argument("--compile", action="store_true",
+                       help="Compile the model with torch.compile, faster for long books")
+    parser.add_argument("--cache-max-gb", type=float, default=2.0,
+                       help="Set the size of the generated audio cache, 0 disables it (default: 2.0)")
+    parser.add_argument("-e", "--engine", default="torch", choices=TextToAudio.ENGINES,
+                       help="Set the inference engine, onnx is faster without a GPU (default: torch)")
+    parser.add_argument("--onnx-model",
+                       help=f"Path to the kokoro-onnx model (default: {TextToAudio.ONNX_MODELS['fp32']}, "
+                            f"{TextToAudio.ONNX_MODELS['int8']} for int8)")
+    parser.add_argument("--onnx-voices",
+                       help=f"Path to the kokoro-onnx voices (default: {TextToAudio.ONNX_VOICES})")
     parser.add_argument("files", nargs="*",
                        help="Input files/dirs")
 
     args = parser.parse_args()
+    if args.precision not in TextToAudio.PRECISIONS and args.engine != "onnx":
+        parser.error(f"--precision {args.precision} needs --engine onnx")
 
     # Launch GUI if requested or no files provided
     if args.gui or (not args.files and not args.mode):
@@ -1,9 +1,15 @@
 #!/usr/bin/env python3
 
+import functools
+import json
 import re
+import shutil
 import subprocess
 import sys
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
 NUM_KEY = 'Track number'
 DEF_KEY = '"Default track" flag'
@@ -12,72 +18,73 @@ TYP_KEY = 'Track type'
 LAN_KEY = 'Language'
 FORCE_KEY = '"Forced display" flag'
 
+printLock = threading.Lock()
+
+@dataclass
+class FileInfo:
+	tracks: list
+
+	@property
+	def trackCount(self):
+		return len(self.tracks)
+
 def runCmd(args):
 	return subprocess.run(args, capture_output=True, text=True)
 
+def runQuiet(args):
+	# output isn't needed, skip subprocess's pipe setup
+	if not hasattr(os, 'posix_spawnp'):
+		return runCmd(args).returncode
+	devnull = [
+		(os.POSIX_SPAWN_OPEN, 1, os.devnull, os.O_WRONLY, 0),
+		(os.POSIX_SPAWN_DUP2, 1, 2),
+	]
+	pid = os.posix_spawnp(args[0], args, os.environ, file_actions=devnull)
+	return os.waitstatus_to_exitcode(os.waitpid(pid, 0)[1])
+
+@functools.cache
 def checkHasCmds():
-	r = runCmd(['mkvinfo', '-V'])
-	if r.returncode != 0:
-		return 1
-	r = runCmd(['mkvpropedit', '-V'])
-	if r.returncode != 0:
-		return 1
-	r = runCmd(['mkvmerge', '-V'])
-	if r.returncode != 0:
-		return 1
-	return 0
-
-def parseTracks(text):
-	tracks = []
-	current_track = {}
-	in_track = False
-
-	for line in text.split('\n'):
-		if line.startswith('| + Track'):
-			if current_track:
-				tracks.append(current_track)
-			current_track = {}
-			in_track = True
-			continue
-		elif line.startswith('|+ ') and in_track:
-			in_track = False
-			continue
-		elif not line.startswith('|  + '):
-			continue
-		elif line.find(':') == -1:
-			continue
-
-		if not in_track:
-			continue
-
-		line = line[5:]
-		name = line[ : line.find(':')].strip()
-		value = line[line.find(':') + 1 : ].strip()
+	return 0 if all(shutil.which(x) for x in ('mkvpropedit', 'mkvmerge')) else 1
 
-		if name == NUM_KEY:
-			value = value.split(' ')[0]
-		current_track[name] = value
+def getFileInfo(fileName):
+	# cached until the file changes
+	st = os.stat(fileName)
+	return identifyFile(fileName, st.st_mtime_ns, st.st_size)
 
-	if current_track:
-		tracks.append(current_track)
+@functools.lru_cache(maxsize=256)
+def identifyFile(fileName, mtime, size):
+	r = runCmd(['mkvmerge', '-J', fileName])
+	# exit code 1 is only warnings
+	if r.returncode > 1:
+		return None
 
-	return tracks
+	tracks = []
+	for t in json.loads(r.stdout).get('tracks', []):
+		prop = t['properties']
+		track = {
+			NUM_KEY: str(prop['number']),
+			DEF_KEY: '1' if prop.get('default_track') else '0',
+			TYP_KEY: t['type'],
+		}
+		if 'language' in prop:
+			track[LAN_KEY] = prop['language']
+		if 'track_name' in prop:
+			track[NAM_KEY] = prop['track_name']
+		if prop.get('forced_track'):
+			track[FORCE_KEY] = '1'
+		tracks.append(track)
+	return FileInfo(tracks)
 
 def printFileInfo(fileName):
-	r = runCmd(['mkvinfo', fileName])
-	if r.returncode != 0:
+	info = getFileInfo(fileName)
+	if info is None:
 		return 0
 
 	print()
 	print('File:', fileName)
 	print('Tracks:')
 
-	data = parseTracks(r.stdout)
-	if not data:
-		return 0
-
-	count = 0
-	for track in data:
+	for track in info.tracks:
 		langKeys = [key for key in track.keys() if key.startswith(LAN_KEY)]
 		if not langKeys:
 			lang = '-'
@@ -89,20 +96,15 @@ def printFileInfo(fileName):
 		typ = track[TYP_KEY].ljust(9) if TYP_KEY in track else ''.ljust(9)
 		name = track[NAM_KEY] if NAM_KEY in track else ''
 		print("", track['Track number'], '|', isDef, '|', lang, '|', typ, '|', name)
-		count += 1
-	return count
+	return info.trackCount
 
-def remuxFile(fileName, data):
+def setTrackFlags(fileName, data):
 	if not data:
 		return
 
-	cmd = ['mkvmerge', '-o', 'tmp.mkv', fileName]
-	print("Remux:", ' '.join(cmd))
-	runCmd(cmd)
-	runCmd(['mv', 'tmp.mkv', fileName])
-
-	r = runCmd(['mkvinfo', fileName])
-	t = parseTracks(r.stdout)
+	# mkvpropedit edits the headers in place, no need to remux the file
+	info = getFileInfo(fileName)
+	t = info.tracks if info else []
 	edits = []
 	for i in t:
 		n = i[NUM_KEY]
@@ -118,8 +120,9 @@ def remuxFile(fileName, data):
 
 	cmd = ['mkvpropedit', fileName]
 	cmd.extend(edits)
-	print("Set Flags:", ' '.join(cmd))
-	runCmd(cmd)
+	with printLock:
+		print("Set Flags:", ' '.join(cmd))
+	runQuiet(cmd)
 
 def parseDefaults(line, count):
 	marks = []
@@ -140,6 +143,18 @@ def parseDefaults(line, count):
 			break
 	return marks
 
+def walkMkv(d):
+	try:
+		it = os.scandir(d)
+	except OSError:
+		return
+	with it:
+		for e in it:
+			if e.is_dir(follow_symlinks=False):
+				yield from walkMkv(e.path)
+			elif e.name.endswith('.mkv'):
+				yield e.path
+
 def findFiles(paths):
 	fileNames = []
 	toSearch = []
@@ -150,10 +165,7 @@ def findFiles(paths):
 			toSearch.append(f)
 
 	for d in toSearch:
-		for root, dirs, files in os.walk(d):
-			for f in files:
-				if f.endswith('.mkv'):
-					fileNames.append(os.path.join(root, f))
+		fileNames.extend(walkMkv(d))
 
 	return fileNames
 
@@ -218,19 +230,19 @@ def main(paths):
 			isBatch = True
 		elif c == 'm' or c == 'l':
 			lastMark = d
-			remuxFile(f, d)
+			setTrackFlags(f, d)
 
 	if batch:
 		print()
 		print('Running batch mode:', lastMark)
-		for f in batch:
-			print()
-			remuxFile(f, lastMark)
+		# the work is in mkvmerge/mkvpropedit, so threads are enough
+		with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+			list(ex.map(lambda f: setTrackFlags(f, lastMark), batch))
 
 
 if __name__ == "__main__":
 	if checkHasCmds():
-		print("Error: install mkvtoolnix to get mkvinfo/mkvpropedit/mkvmerge programs")
+		print("Error: install mkvtoolnix to get mkvpropedit/mkvmerge programs")
 		exit(1)
 
 	if len(sys.argv) == 1:
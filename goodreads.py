@@ -1,41 +1,120 @@
 #!/usr/bin/env python3
 
-import urllib.request
-import bs4
-import sys, time
+import httpx
+from selectolax.lexbor import LexborHTMLParser
+import sys, time, os
 import getopt
+import html
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+try:
+	import orjson
+except ImportError:
+	orjson = None
+
+HTML_HEADER = '''<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
+<head>
+	<meta http-equiv="Content-Type" content="text/html;charset=utf-8">
+	<title>Goodreads Books</title>
+	<link rel="stylesheet" type="text/css" href="https://cdn.datatables.net/1.11.5/css/jquery.dataTables.css">
+	<script type="text/javascript" charset="utf8" src="https://code.jquery.com/jquery-3.6.0.min.js"></script>
+	<script type="text/javascript" charset="utf8" src="https://cdn.datatables.net/1.11.5/js/jquery.dataTables.js"></script>
+</head>
+<body>
+
+<script>
+// Initialize DataTable on the table
+$(document).ready( function () {
+	$('#sortableTable').DataTable();
+});
+</script>
+
+<table id="sortableTable">
+<thead>
+<tr><th>Image</th><th>Title</th><th>Average</th><th>Ratings</th></tr>
+</thead>
+'''
 
 # copy cookie from browser
 with open('goodreads.cookie', 'r') as f:
     cookie = f.read().strip()
 
-def debugTag(tag, indent='\t'):
-	lines = str(tag).splitlines()
-	lines = ['\t' + line for line in lines]
-	lines = '\n'.join(lines)
-	# print('<!-- Bad Tag:\n' + lines + '\n-->')
+# one http/2 connection shared by all pages
+session = httpx.Client(http2=True, headers={'Cookie': cookie}, follow_redirects=True, timeout=30)
+
+# parsed rows of each page, reused for a day
+CACHE_DIR = '.gr_cache'
+CACHE_AGE = 24 * 60 * 60
+
+# seconds between requests, shared by all fetch threads
+REQUEST_INTERVAL = 2
+rateLock = threading.Lock()
+nextRequest = 0.0
+
+def waitRateLimit():
+	global nextRequest
+	with rateLock:
+		now = time.monotonic()
+		wait = nextRequest - now
+		nextRequest = max(now, nextRequest) + REQUEST_INTERVAL
+	if wait > 0:
+		time.sleep(wait)
 
 def getPageData(typ, name, page):
 	url = "https://www.goodreads.com/" + typ + "/show/" + name + "?page=" + str(page)
+	waitRateLimit()
 	print('<!-- loading ' + url + ' -->')
-	req = urllib.request.Request(url)
-	req.add_header("Cookie", cookie)
-	page = urllib.request.urlopen(req).read()
-	return bs4.BeautifulSoup(page, "lxml")
+	r = session.get(url)
+	r.raise_for_status()
+	page = r.content
+	return LexborHTMLParser(page)
+
+def readCache(path):
+	try:
+		if time.time() - os.path.getmtime(path) > CACHE_AGE:
+			return None
+		with open(path, 'rb') as f:
+			data = f.read()
+	except OSError:
+		return None
+	return orjson.loads(data) if orjson else json.loads(data)
+
+def writeCache(path, rows):
+	os.makedirs(CACHE_DIR, exist_ok=True)
+	data = orjson.dumps(rows) if orjson else json.dumps(rows).encode()
+	with open(path, 'wb') as f:
+		f.write(data)
+
+def getPageRows(typ, name, page):
+	cacheFile = os.path.join(CACHE_DIR, (typ + '_' + name + '_' + str(page)).replace('/', '_') + '.json')
+	rows = readCache(cacheFile)
+	if rows:
+		print('<!-- cached ' + cacheFile + ' -->')
+		return rows
+
+	data = getPageData(typ, name, page)
+	if typ == "list":
+		rows = getListRows(data)
+	else:
+		rows = getShelfRows(data)
+	# no rows is likely a sign-in page from an expired cookie, don't keep it
+	if rows:
+		writeCache(cacheFile, rows)
+	return rows
 
-def getListRows(html):
-	data = html.find_all('td')
+def getListRows(tree):
+	# only the cells holding a book
+	data = tree.css('td:has(a.bookTitle)')
 	rows = {}
 
 	for td in data:
-		aTag = td.find('a', class_="bookTitle")
-		if aTag is None:
-			debugTag(td)
-			continue
-		title = aTag.text.strip()
-		link = "https://www.goodreads.com" + aTag.attrs['href']
-
-		rating = td.find('span', class_="minirating").text
+		aTag = td.css_first('a.bookTitle')
+		title = aTag.text().strip()
+		link = "https://www.goodreads.com" + aTag.attributes['href']
+
+		rating = td.css_first('span.minirating').text()
 		parts = rating.strip().split(' ')
 		if len(parts) == 6:
 			avg = float(parts[0])
@@ -44,35 +123,32 @@ def getListRows(html):
 			avg = float(parts[-6])
 			count = int(parts[-2].replace(',', ''))
 
-		img = td.findParent().find('img', class_="bookCover")
-		img = img.attrs['src']
+		img = td.parent.css_first('img.bookCover').attributes['src']
 
 		rows[title] = {'img': img, 'link': link, 'title': title, 'avg': avg, 'count': count}
 
 	return rows
 
-def getShelfRows(html):
-	data = html.find_all('div', class_="elementList")
+def getShelfRows(tree):
+	data = tree.css('div.elementList:has(a.bookTitle)')
 	rows = {}
 
 	for div in data:
-		aTag = div.find('a', class_="bookTitle")
-		if aTag is None:
-			debugTag(div)
-			continue
-		title = aTag.text.strip()
-		link = "https://www.goodreads.com" + aTag.attrs['href']
-
-		spans = div.find_all('span', class_="greyText")
+		aTag = div.css_first('a.bookTitle')
+		title = aTag.text().strip()
+		link = "https://www.goodreads.com" + aTag.attributes['href']
+
+		spans = div.css('span.greyText')
 		for sp in spans:
-			if sp.text.find("rating") < 0:
+			text = sp.text()
+			if text.find("rating") < 0:
 				continue
-			parts = sp.text.strip().split()
+			parts = text.strip().split()
 			avg = float(parts[2])
 			count = int(parts[4].replace(',', ''))
 			break
 
-		img = div.find('img').attrs['src']
+		img = div.css_first('img').attributes['src']
 
 		rows[title] = {'img': img, 'link': link, 'title': title, 'avg': avg, 'count': count}
 
@@ -84,21 +160,17 @@ def getAllPages(query, minAvg, minCount):
 	pageCount = query[2]
 
 	table = {}
-	for i in range(pageCount):
-		data = getPageData(listType, listName, i + 1)
-		if listType == "list":
-			rows = getListRows(data)
-		else:
-			rows = getShelfRows(data)
-		print('<!-- Found ' + str(len(rows)) + ' rows -->')
-
-		for k,v in rows.items():
-			if v['avg'] >= minAvg and v['count'] >= minCount:
-				table[k] = v
-			else:
-				print('<!-- removing book: ' + str(v) + ' -->')
-
-		time.sleep(2)
+	with ThreadPoolExecutor(max_workers=4) as ex:
+		# a page's request starts while the earlier ones are still loading
+		pages = ex.map(lambda i: getPageRows(listType, listName, i + 1), range(pageCount))
+		for rows in pages:
+			print('<!-- Found ' + str(len(rows)) + ' rows -->')
+
+			for k,v in rows.items():
+				if v['avg'] >= minAvg and v['count'] >= minCount:
+					table[k] = v
+				else:
+					print('<!-- removing book: ' + str(v) + ' -->')
 
 	return table
 
@@ -111,34 +183,13 @@ def buildHtml(pages, minAvg, minCount):
 	table = list(table.values())
 	table.sort(key=lambda x : -x['avg'])
 
-	print('''<!DOCTYPE html>
-	<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
-	<head>
-		<meta http-equiv="Content-Type" content="text/html;charset=utf-8">
-		<title>Goodreads Books</title>
-		<link rel="stylesheet" type="text/css" href="https://cdn.datatables.net/1.11.5/css/jquery.dataTables.css">
-		<script type="text/javascript" charset="utf8" src="https://code.jquery.com/jquery-3.6.0.min.js"></script>
-		<script type="text/javascript" charset="utf8" src="https://cdn.datatables.net/1.11.5/js/jquery.dataTables.js"></script>
-	</head>
-	<body>
-
-	<script>
-	// Initialize DataTable on the table
-	$(document).ready( function () {
-		$('#sortableTable').DataTable();
-	});
-	</script>
-
-	<table id="sortableTable">
-	<thead>
-	<tr><th>Image</th><th>Title</th><th>Average</th><th>Ratings</th></tr>
-	</thead>
-	''')
-
+	out = [HTML_HEADER]
 	for i in table:
-		print('<tr><td><img src="{}" alt="{}"></td><td><a href="{}">{}</a></td><td>{}</td><td>{}</td></tr>'.format(i['img'], i['title'], i['link'], i['title'], i['avg'], i['count']))
-	print('</table>')
-	print('</body></html>')
+		title = html.escape(i['title'])
+		out.append(f'<tr><td><img src="{html.escape(i["img"])}" alt="{title}"></td>'
+			f'<td><a href="{html.escape(i["link"])}">{title}</a></td><td>{i["avg"]}</td><td>{i["count"]}</td></tr>\n')
+	out.append('</table>\n</body></html>\n')
+	sys.stdout.write(''.join(out))
 
 
 try:
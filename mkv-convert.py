@@ -1,15 +1,21 @@
 #!/usr/bin/env python3
 
 import os
+import subprocess
 
-tmp_files = "/tmp/mkv-convert-files"
+extensions = {'.avi', '.mp4', '.mov', '.mpg', '.mpeg', '.divx', '.m4v'}
 
-os.system('find ./ -name "*.avi" -o -name "*.mp4" -o -name "*.mov" -o -name "*.mpg" -o -name "*.mpeg" -o -name "*.divx" -o -name "*.m4v" > ' + tmp_files)
+def findFiles(d):
+	with os.scandir(d) as it:
+		for e in it:
+			if e.is_dir(follow_symlinks=False):
+				yield from findFiles(e.path)
+			elif os.path.splitext(e.name)[1] in extensions:
+				yield e.path
 
-for file in open(tmp_files, "r"):
-	file = file[:-1]
+for file in findFiles('.'):
 	filename = os.path.splitext(file)
-	os.system('mkvmerge -o "' + filename[0] + '.mkv" "' + file + '"')
-	os.system('rm "' + file + '"')
-
-os.system("rm " + tmp_files)
+	r = subprocess.run(['mkvmerge', '-o', filename[0] + '.mkv', file])
+	# exit code 1 is only warnings, keep the original if mkvmerge failed
+	if r.returncode < 2:
+		os.remove(file)
@@ -1,31 +1,22 @@
 #!/usr/bin/env python3
 
-import os, fnmatch
+import os
 
 def getFiles():
-	files = []
-	for root, dirnames, filenames in os.walk('.'):
-		for filename in fnmatch.filter(filenames, '*.mkv'):
-			files.append(filename)
+	with os.scandir('.') as it:
+		files = [e.name for e in it if e.name.endswith('.mkv') and e.is_file()]
 	files.sort()
 	return files
 
 def getNames():
-	names = []
 	with open('list') as fileNames:
-		for line in fileNames.readlines():
-			names.append(line.strip())
-	return names
+		return [line.strip() for line in fileNames]
 
 def rename(files, names):
 	if len(files) != len(names):
 		print("size miss match")
 		return
-	for i in range(len(files)):
-		end = files[i].rfind('.')
-		newname = names[i] + '.mkv'
-#		newname = files[i][0:end] + ' ' + names[i] + '.mkv'
-#		print newname
-		os.rename(files[i], newname)
+	for old, new in zip(files, names):
+		os.rename(old, new + '.mkv')
 
 rename(getFiles(), getNames())